@@ -1,60 +1,278 @@
 import streamlit as st
 import pandas as pd
-from geopy.geocoders import Nominatim
+import numpy as np
+from geopy.geocoders import Nominatim, Photon, OpenCage
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from geopy.extra.rate_limiter import RateLimiter
+from geopy.adapters import RequestsAdapter
 import folium
 import time
+import random
 import re
-from fuzzywuzzy import process, fuzz
-from folium.plugins import HeatMap
+import functools
+import html
+import io
+import itertools
+import threading
+import diskcache
+import openpyxl
+from concurrent.futures import ThreadPoolExecutor
+from rapidfuzz import process, fuzz, utils
+from folium.plugins import HeatMap, FastMarkerCluster
 from shapely.geometry import Polygon
 
+GEOCODE_CACHE_DIR = "./.geocode_cache"
+GEOCODE_HIT_TTL = 30 * 24 * 60 * 60  # Refresh cached coordinates after 30 days
+GEOCODE_MISS_TTL = 24 * 60 * 60  # Re-try addresses that returned no result after a day
+GEOCODE_MAX_BACKOFF = 60  # Upper bound in seconds on a single retry delay
+
+# Selectable geocoding services: label -> (geopy geocoder class, seconds between requests, workers).
+# Public Nominatim and Photon ask for light use; OpenCage plans allow parallel requests.
+GEOCODER_BACKENDS = {
+    "Nominatim (OSM, 1 rps)": (Nominatim, 1.0, 4),
+    "Photon": (Photon, 1.0, 4),
+    "OpenCage": (OpenCage, 0.0, 10),
+}
+SELF_HOSTED_WORKERS = 16  # Self-hosted endpoints have no usage policy, so they run unthrottled
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s,]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Builds a marker with its address popup from a [lat, lng, popup] row of FastMarkerCluster data
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2]);
+    return marker;
+};
+"""
+
+@st.cache_resource
+def get_geocode_cache():
+    """Opens the on-disk geocode cache once per process rather than on every script rerun."""
+    return diskcache.Cache(GEOCODE_CACHE_DIR)
+
+@functools.lru_cache(maxsize=65536)
 def clean_address(address):
     """Cleans up the address string by removing unnecessary punctuations and spaces."""
-    address = re.sub(r'[^\w\s,]', '', address)  # Remove all punctuation except commas
-    address = ' '.join(address.split())  # Remove extra whitespace
-    return address
-
-def correct_typo(text, choices, threshold=70):
-    """Corrects typos in a text using fuzzy matching with a set of choices."""
-    if not text or not choices:
-        return text
-
-    best_match, score = process.extractOne(text, choices, scorer=fuzz.ratio)
-    if score >= threshold:
-        return best_match
-    return text
-
-def geocode_address(address, city, geolocator, state=None, postal_code=None, max_retries=3):
-    """Geocodes an address with retry logic."""
+    address = _PUNCTUATION_RE.sub('', address)  # Remove all punctuation except commas
+    return _WHITESPACE_RE.sub(' ', address).strip()  # Remove extra whitespace
+
+def correct_typos(texts, choices, threshold=70):
+    """
+    Corrects typos by fuzzy matching texts against a reference list of choices. Every text not
+    already in the choices is scored against all of them in a single multi-threaded rapidfuzz
+    cdist call. Returns a dict mapping each text to its correction.
+    """
+    choices = list(choices)
+    known = frozenset(choices)
+    corrections = {text: text for text in texts}
+    queries = [text for text in corrections if text and text not in known]
+    if not queries or not choices:
+        return corrections
+
+    # Lowercase/strip punctuation once per string rather than once per comparison
+    processed_queries = [utils.default_process(text) for text in queries]
+    processed_choices = [utils.default_process(choice) for choice in choices]
+    # Plain edit-distance ratio: token_set_ratio scores 100 whenever one name's words are a subset
+    # of the other's, which would fold "York" into "New York"
+    scores = process.cdist(processed_queries, processed_choices, scorer=fuzz.ratio, dtype=np.uint8, workers=-1)
+    best = scores.argmax(axis=1)
+    best_scores = scores[np.arange(len(queries)), best]
+    for text, index, score in zip(queries, best, best_scores):
+        if score >= threshold:
+            corrections[text] = choices[index]
+    return corrections
+
+def backoff_delay(retry, error=None):
+    """Exponential backoff with jitter, honouring the Retry-After of a rate-limited response."""
+    delay = 2 ** retry + random.uniform(0, 1)
+    retry_after = getattr(error, "retry_after", None)  # Set by GeocoderRateLimited on HTTP 429
+    if retry_after:
+        delay = max(delay, float(retry_after))
+    return min(delay, GEOCODE_MAX_BACKOFF)
+
+def geocode_address(address, city, geocode, state=None, postal_code=None, max_retries=3, cache_namespace="nominatim",
+                    memo=None, cache=None):
+    """
+    Geocodes an address with retry logic, consulting the in-memory `memo` dict and then the
+    on-disk `cache` (get_geocode_cache() by default) first.
+    `geocode` is a geocoder's `geocode` method, optionally wrapped in a RateLimiter.
+    `cache_namespace` keeps each backend's results (and misses) apart in the cache.
+    """
+    if memo is None:
+        memo = {}
+    if cache is None:
+        cache = get_geocode_cache()
     full_address = f"{address}, {city}"
-    if state:
+    # pd.notna guards against missing values (pd.NA is not usable in a boolean context)
+    if pd.notna(state) and state:
         full_address += f", {state}"
-    if postal_code:
+    if pd.notna(postal_code) and postal_code:
       full_address += f", {postal_code}"
     full_address = clean_address(full_address)
 
+    key = f"{cache_namespace}:{full_address.lower()}"
+    if key in memo:
+        return memo[key]
+    cached = cache.get(key)
+    if cached is not None:
+        memo[key] = cached
+        return cached
+
+    not_found = False
     for retry in range(max_retries):
       try:
-        location = geolocator.geocode(full_address, timeout=10)
+        location = geocode(full_address, timeout=10)
         if location:
-          return location.latitude, location.longitude
+          result = (location.latitude, location.longitude)
+          cache.set(key, result, expire=GEOCODE_HIT_TTL)
+          memo[key] = result
+          return result
+        # A None result is a definitive answer; re-sending the same query only burns quota
+        not_found = True
+        break
       except (GeocoderTimedOut, GeocoderServiceError) as e:
-          print(f"Geocoding error for address '{full_address}': {e}. Retrying ({retry + 1}/{max_retries}) after a delay.")
-          time.sleep(5)
+          print(f"Geocoding error for address '{full_address}': {e} (attempt {retry + 1}/{max_retries}).")
+          if retry < max_retries - 1:
+              time.sleep(backoff_delay(retry, e))
     print(f"Failed to geocode address: {full_address}")
+    if not_found:
+        # Only cache genuine misses, not timeouts or service errors
+        cache.set(key, (None, None), expire=GEOCODE_MISS_TTL)
+        memo[key] = (None, None)
     return None, None
 
 
+@st.cache_data
+def load_data(file_bytes, file_name):
+    """
+    Parses the uploaded CSV or Excel file into Arrow-backed columns; cached on its contents
+    so reruns skip the parse.
+    """
+    if file_name.endswith('.csv'):
+        try:
+            return pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow", dtype_backend="pyarrow")
+        except (ImportError, ValueError):
+            # pyarrow missing or unable to parse the file; fall back to the C engine
+            return pd.read_csv(io.BytesIO(file_bytes), dtype_backend="pyarrow")
+
+    try:
+        return pd.read_excel(io.BytesIO(file_bytes), engine="calamine", dtype_backend="pyarrow")
+    except (ImportError, ValueError):
+        # python-calamine missing or pandas too old for it; fall back to openpyxl
+        pass
+
+    # Stream rows in read-only mode instead of loading the whole workbook into memory
+    workbook = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, ())
+        df = pd.DataFrame(rows, columns=header)
+    finally:
+        workbook.close()
+    return df.convert_dtypes(dtype_backend="pyarrow")
+
+def has_secret(name):
+    """Checks st.secrets for a key, treating a missing secrets.toml as the key being absent."""
+    try:
+        return name in st.secrets
+    except FileNotFoundError:  # StreamlitSecretNotFoundError subclasses it
+        return False
+
+def create_geolocator(backend, domain=None, api_key=None):
+    """Instantiates the geopy geocoder for a backend, optionally pointed at a self-hosted domain."""
+    geocoder_class = GEOCODER_BACKENDS[backend][0]
+    kwargs = {"user_agent": "merchant_mapper_app", "timeout": 10, "adapter_factory": RequestsAdapter}
+    if api_key:
+        kwargs["api_key"] = api_key
+    if domain:
+        # Accept "http://host:port" as well as a bare host
+        scheme, _, host = domain.rpartition("://")
+        kwargs["domain"] = host
+        if scheme:
+            kwargs["scheme"] = scheme
+    return geocoder_class(**kwargs)
+
+@st.cache_resource
+def get_geocoder(backend, domain=None):
+    """
+    Returns a geocode function for the backend, shared across reruns and sessions. It is meant
+    to run on get_geocode_executor's long-lived workers.
+    """
+    geocoder_class, min_delay, _ = GEOCODER_BACKENDS[backend]
+    api_key = st.secrets["opencage_key"] if geocoder_class is OpenCage else None
+    # One geocoder per worker thread: each keeps its own requests.Session (which is not
+    # thread-safe). The workers outlive a batch, so their keep-alive connections do too.
+    thread_local = threading.local()
+
+    def geocode(query, **kwargs):
+        geolocator = getattr(thread_local, "geolocator", None)
+        if geolocator is None:
+            geolocator = thread_local.geolocator = create_geolocator(backend, domain, api_key)
+        return geolocator.geocode(query, **kwargs)
+
+    if domain or not min_delay:
+        return geocode
+    # The limiter is shared by all workers, so the public usage policy holds under concurrency.
+    # Errors are left to geocode_address's own retry loop.
+    return RateLimiter(geocode, min_delay_seconds=min_delay, max_retries=0, swallow_exceptions=False)
+
+@st.cache_resource
+def get_geocode_executor(backend, domain=None):
+    """Returns the backend's worker pool, kept for the life of the process so sessions persist."""
+    workers = SELF_HOSTED_WORKERS if domain else GEOCODER_BACKENDS[backend][2]
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geocode")
+
+def geocode_batch(addresses, backend, domain=None, memo=None):
+    """
+    Geocodes (address, city, state, postal_code) tuples concurrently, preserving their order.
+    Not st.cache_data'd: the disk cache and `memo` already make reruns cheap, and caching the
+    whole list would also pin transient failures.
+    """
+    geocoder_class = GEOCODER_BACKENDS[backend][0]
+    geocode = get_geocoder(backend, domain)
+    executor = get_geocode_executor(backend, domain)
+    cache = get_geocode_cache()
+    namespace = geocoder_class.__name__.lower()
+    if domain:
+        # A self-hosted server has its own data; don't share hits or misses with the public one
+        namespace = f"{namespace}@{domain}"
+    # Overlap network latency; cache hits return without waiting on the limiter
+    futures = [executor.submit(geocode_address, address, city, geocode, state, postal_code,
+                               cache_namespace=namespace, memo=memo, cache=cache)
+               for address, city, state, postal_code in addresses]
+    return [future.result() for future in futures]
+
+def create_marker_map(df, popups):
+    """
+    Generates a marker map, shipping all markers as a single JS array clustered client-side
+    """
+    m = folium.Map(location=[df['latitude'].mean(), df['longitude'].mean()], zoom_start=10)
+    marker_data = df[['latitude', 'longitude']].assign(popup=[html.escape(p) for p in popups]).to_numpy().tolist()
+    FastMarkerCluster(marker_data, callback=MARKER_CALLBACK).add_to(m)
+    return m
+
 def create_heatmap(df):
     """
     Generates a heatmap
     """
-    heat_data = df[['latitude', 'longitude']].dropna().values.tolist()
+    heat_data = df[['latitude', 'longitude']].dropna().to_numpy()
     m = folium.Map(location=[df['latitude'].mean(), df['longitude'].mean()], zoom_start=10, tiles="cartodbdarkmatter")
     HeatMap(heat_data).add_to(m)
     return m
 
+@st.cache_data(show_spinner=False, max_entries=8)  # Rendered HTML can be several MB per dataset
+def render_map(coords_bytes, popups, kind):
+    """
+    Renders the "markers" or "heatmap" map to HTML. Keyed on the raw coordinate bytes so
+    reruns with unchanged data skip re-rendering the folium template.
+    """
+    coords = np.frombuffer(coords_bytes, dtype=np.float64).reshape(-1, 2)
+    df = pd.DataFrame(coords, columns=['latitude', 'longitude'])
+    m = create_heatmap(df) if kind == "heatmap" else create_marker_map(df, popups)
+    return m.get_root().render()
+
 def main():
     st.title("Merchant Location Mapper")
 
@@ -62,10 +280,7 @@ def main():
 
     if uploaded_file:
         try:
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            df = load_data(uploaded_file.getvalue(), uploaded_file.name)
 
             st.write("Data Preview:")
             st.dataframe(df.head())
@@ -74,27 +289,48 @@ def main():
             city_column = st.selectbox("Select City Column", df.columns)
             state_column = st.selectbox("Select State Column (Optional)", ['None'] + list(df.columns))
             postal_code_column = st.selectbox("Select Postal Code Column (Optional)", ['None'] + list(df.columns))
+            geocoder_backend = st.selectbox("Geocoder", list(GEOCODER_BACKENDS))
+            geocoder_domain = st.text_input("Self-hosted geocoder domain (optional, disables rate limiting)",
+                                            placeholder="http://localhost:8080").strip() or None
 
             if st.button("Process Data & Map"):
-                # Initialize geolocator
-                geolocator = Nominatim(user_agent="merchant_mapper_app", timeout=10)
+                if GEOCODER_BACKENDS[geocoder_backend][0] is OpenCage and not has_secret("opencage_key"):
+                    st.error("OpenCage needs an `opencage_key` entry in .streamlit/secrets.toml")
+                    return
 
                 with st.spinner("Geocoding addresses..."):
                   # Geocode addresses and add lat/long columns
-                  geocoded_results = []
-                  all_cities = df[city_column].dropna().unique().tolist() # Get all unique cities for typo checking
+                  all_cities = tuple(df[city_column].dropna().unique()) # Get all unique cities for typo checking
+                  # Fuzzy-match each distinct city once, in a single batched scoring call
+                  city_corrections = correct_typos(all_cities, all_cities)
+
+                  # Geocode each distinct address once, then fan the results back out to every row
+                  key_cols = list(dict.fromkeys(
+                      [address_column, city_column] + [c for c in (state_column, postal_code_column) if c != 'None']))
+                  unique_addresses = df[key_cols].drop_duplicates().reset_index(drop=True)
+
+                  # Zip plain column arrays instead of building a Series per row with iterrows
+                  addresses = unique_addresses[address_column].to_numpy()
+                  cities = unique_addresses[city_column].to_numpy()
+                  states = unique_addresses[state_column].to_numpy() if state_column != 'None' else itertools.repeat(None)
+                  postal_codes = (unique_addresses[postal_code_column].to_numpy() if postal_code_column != 'None'
+                                  else itertools.repeat(None))
 
-                  for index, row in df.iterrows():
-                    city = row[city_column]
-                    address = row[address_column]
+                  jobs = []
+                  for address, city, state, postal_code in zip(addresses, cities, states, postal_codes):
                      #Try to fix city typos
-                    city = correct_typo(city, all_cities)
-                    state = row[state_column] if state_column != 'None' else None
-                    postal_code = row[postal_code_column] if postal_code_column != 'None' else None
-                    lat, lng = geocode_address(address, city, geolocator, state, postal_code)
-                    geocoded_results.append((lat, lng))
+                    city = city_corrections.get(city, city)
+                    jobs.append((address, city, state, postal_code))
 
-                  df['latitude'], df['longitude'] = zip(*geocoded_results)
+                  # Results persist in the session so reruns and re-uploads skip already-seen addresses
+                  memo = st.session_state.setdefault("geocode_cache", {})
+                  geocoded_results = geocode_batch(tuple(jobs), geocoder_backend, geocoder_domain, memo=memo)
+
+                  coords = np.asarray(geocoded_results, dtype=np.float64).reshape(-1, 2)  # Failed lookups become NaN
+                  unique_addresses['latitude'] = coords[:, 0]
+                  unique_addresses['longitude'] = coords[:, 1]
+                  df = df.drop(columns=['latitude', 'longitude'], errors='ignore')
+                  df = df.merge(unique_addresses, on=key_cols, how='left')
 
                 # Handle un-geocoded locations
                 df_unmapped = df[df['latitude'].isna()]
@@ -113,22 +349,15 @@ def main():
 
                   st.subheader("Merchant Map")
 
-                  # Create the base map
-                  m = folium.Map(location=[df_mapped['latitude'].mean(), df_mapped['longitude'].mean()], zoom_start=10)
+                  coords_bytes = df_mapped[['latitude', 'longitude']].to_numpy(dtype=np.float64).tobytes()
 
-                  # Plot points as markers
-                  for _, row in df_mapped.iterrows():
-                      folium.Marker([row['latitude'], row['longitude']], popup=row[address_column]).add_to(m)
-                  
                   # Display the map
-                  st_folium = folium.folium_static(m)
-                  st.components.v1.html(st_folium._repr_html_(), height=450, width = 800)
-                
+                  popups = tuple(df_mapped[address_column].astype(str))
+                  st.components.v1.html(render_map(coords_bytes, popups, "markers"), height=450, width = 800)
+
                   # Create a heatmap
                   st.subheader("Merchant Density")
-                  heatmap = create_heatmap(df_mapped)
-                  st_folium_heat = folium.folium_static(heatmap)
-                  st.components.v1.html(st_folium_heat._repr_html_(), height=450, width = 800)
+                  st.components.v1.html(render_map(coords_bytes, (), "heatmap"), height=450, width = 800)
 
         except Exception as e:
             st.error(f"Error processing file: {e}")
@@ -0,0 +1,106 @@
+import diskcache
+import pytest
+from geopy.exc import GeocoderTimedOut
+
+import app
+from app import correct_typos, geocode_address
+
+
+class Location:
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with diskcache.Cache(str(tmp_path)) as cache:
+        yield cache
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(app.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_geocode_address_caches_a_miss_without_retrying(cache, sleeps):
+    calls = []
+
+    def geocode(query, timeout=None):
+        calls.append(query)
+        return None
+
+    assert geocode_address("1 Main St", "Springfield", geocode, cache=cache) == (None, None)
+    assert calls == ["1 Main St, Springfield"]
+    assert sleeps == []
+    assert cache.get("nominatim:1 main st, springfield") == (None, None)
+
+    # The cached miss is served without another request
+    assert geocode_address("1 Main St", "Springfield", geocode, cache=cache) == (None, None)
+    assert len(calls) == 1
+
+
+def test_geocode_address_does_not_cache_timeouts_or_sleep_after_last_attempt(cache, sleeps):
+    calls = []
+
+    def geocode(query, timeout=None):
+        calls.append(query)
+        raise GeocoderTimedOut("timed out")
+
+    memo = {}
+    assert geocode_address("1 Main St", "Springfield", geocode, max_retries=3, memo=memo, cache=cache) == (None, None)
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+    assert memo == {}
+    assert "nominatim:1 main st, springfield" not in cache
+
+
+def test_geocode_address_serves_hits_from_memo_and_disk_cache(cache, sleeps):
+    calls = []
+
+    def geocode(query, timeout=None):
+        calls.append(query)
+        return Location(1.5, 2.5)
+
+    memo = {}
+    assert geocode_address("1 Main St", "Springfield", geocode, memo=memo, cache=cache) == (1.5, 2.5)
+    assert len(calls) == 1
+    assert memo == {"nominatim:1 main st, springfield": (1.5, 2.5)}
+
+    # From the session memo
+    assert geocode_address("1 Main St", "Springfield", geocode, memo=memo, cache=cache) == (1.5, 2.5)
+    # From the disk cache, with a fresh memo as in a new session
+    assert geocode_address("1 Main St", "Springfield", geocode, memo={}, cache=cache) == (1.5, 2.5)
+    assert len(calls) == 1
+
+
+def test_correct_typos_skips_scoring_for_exact_matches(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("cdist should not run when every text is a known choice")
+
+    monkeypatch.setattr(app.process, "cdist", fail)
+    cities = ("Boston", "Chicago", "New York")
+    assert correct_typos(cities, cities) == {city: city for city in cities}
+
+
+def test_correct_typos_preprocesses_each_string_once(monkeypatch):
+    processed = []
+    default_process = app.utils.default_process
+
+    def counting_process(text):
+        processed.append(text)
+        return default_process(text)
+
+    monkeypatch.setattr(app.utils, "default_process", counting_process)
+    corrections = correct_typos(("BOSTON!", "chicago", "Boston"), ("Boston", "Chicago", "Denver"))
+
+    # Only the two unknown queries and each choice, not once per comparison
+    assert sorted(processed) == sorted(["BOSTON!", "chicago", "Boston", "Chicago", "Denver"])
+    assert corrections == {"BOSTON!": "Boston", "chicago": "Chicago", "Boston": "Boston"}
+
+
+def test_correct_typos_leaves_unmatched_and_empty_texts():
+    corrections = correct_typos(("Denver", ""), ("Boston", "Chicago"))
+    assert corrections == {"Denver": "Denver", "": ""}